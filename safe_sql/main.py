@@ -1,13 +1,86 @@
 import click
 import sqlalchemy
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import create_engine, text, inspect, MetaData, Table, Column, Integer, String, DateTime, JSON, func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql.elements import TextClause
 from enum import Enum
-from typing import Optional, Dict, Any
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple
+import functools
 import re
+try:
+    import re2 as re_fast # optional, RE2 matches in linear time whatever the query looks like.
+except ImportError:
+    re_fast = re
 import logging
-from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import atexit
+import time
 import hashlib
 import json
+try:
+    import orjson # optional, much faster encoder/decoder for the result cache.
+except ImportError:
+    orjson = None
+import os
+import sys
+import threading
+from collections import OrderedDict
+import uuid
+import base64
+import datetime
+
+# One alternation covering everything the unsafe-query checks look for, so the query is scanned once.
+# String literals and comments are matched first and skipped, so nothing inside them counts as SQL.
+# Parentheses are matched too, so clauses of subqueries can be told apart from the statement's own.
+# Inline (?i) rather than a flag argument, since the RE2 bindings don't all take `re` flags.
+_QUERY_TOKEN_PATTERN = (
+    r"(?i)(?P<skip>'(?:[^']|'')*'|--[^\n]*|/\*[\s\S]*?\*/)"
+    r'|(?P<paren>[()])'
+    r'|(?P<source>\b(?:FROM|UPDATE)\s+(?P<table>\w+))'
+    r'|(?P<where>\bWHERE\b\s*)'
+    r'|(?P<set>\bSET\b)'
+    r'|(?P<tail>\bORDER\s+BY\b|\bLIMIT\b)'
+    r'|(?P<terminator>;)'
+    r'|\b(?P<column>\w+)\s*=\s*(?P<null>NULL\b)?'
+)
+# RE2's \w and \b are ASCII-only, so the stdlib engine is made ASCII too: both parse the same identifiers.
+if re_fast is re:
+    _QUERY_TOKEN_RE = re.compile(_QUERY_TOKEN_PATTERN, re.ASCII)
+else:
+    _QUERY_TOKEN_RE = re_fast.compile(_QUERY_TOKEN_PATTERN)
+_TABLE_GROUP = _QUERY_TOKEN_RE.groupindex['table'] # google-re2's match.start() only takes group numbers.
+
+_HASH_TEMPLATE = hashlib.blake2b(digest_size=16) # copied per query, cheaper than a fresh hasher each time.
+_RESULT_CACHE_DIR = "query_cache"
+_RESULT_CACHE_SIZE = 1024 # results kept in memory in front of the files.
+
+def _dump_json(result) -> bytes:
+    """ Serialise a cached result, with orjson when it is installed. """
+    if orjson is not None:
+        return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS) # int keys become strings, like json.dumps.
+    return json.dumps(result).encode('utf-8')
+
+def _load_json(data: bytes):
+    """ Counterpart of `_dump_json`. """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Started by the first SafeSQL instance, owns the actual log file.
+_log_listener: Optional[QueueListener] = None
+
+# Every backup lands in this one table, one JSON document per affected row, instead of a new table per query.
+_BACKUP_BATCH_SIZE = 1000
+_BACKUP_TABLE = Table(
+    'safe_sql_backups', MetaData(),
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('backup_id', String(64), nullable=False, index=True),
+    Column('source_table', String(255), nullable=False),
+    Column('created_at', DateTime(timezone=True), server_default=func.now()),
+    Column('row', JSON().with_variant(JSONB(), 'postgresql')),
+)
 
 class Mode(Enum):
     """ Access mode gives the user priviledges based on the mode."""
@@ -15,164 +88,353 @@ class Mode(Enum):
     WRITE = "write"
     ADMIN = "admin"     # we can add an auth to have admin priviledges.
 
+@dataclass(frozen=True)
+class ParsedQuery:
+    """ Pieces of an UPDATE/DELETE query, gathered in a single pass by `_parse_query`. """
+    kind: str
+    table: str
+    where_span: Optional[Tuple[int, int]] = None
+    target_span: Optional[Tuple[int, int]] = None # the table and any alias, e.g. 'users u'.
+    tail_span: Optional[Tuple[int, int]] = None # trailing ORDER BY / LIMIT, up to the terminator.
+    col_assignments: Tuple[str, ...] = ()
+    eq_null_found: bool = False
+
+    @property
+    def has_where(self) -> bool:
+        return self.where_span is not None
+
+@functools.lru_cache(maxsize=256) # frozen result, so the same query is only scanned once.
+def _parse_query(query: str) -> ParsedQuery:
+    """ Walk the query once, picking up the table, the WHERE clause span and the `column =` assignments. """
+    table = None
+    target_start = target_end = where_start = tail_start = None
+    stmt_end = len(query)
+    col_assignments = []
+    eq_null_found = False
+    depth = 0 # only FROM/WHERE/ORDER BY/LIMIT/; outside any parentheses belong to the statement itself.
+    for match in _QUERY_TOKEN_RE.finditer(query):
+        if match.group('skip'):
+            continue
+        elif match.group('paren'):
+            depth += 1 if match.group('paren') == '(' else -1
+        elif match.group('source'):
+            if table is None and depth == 0:
+                table = match.group('table')
+                target_start = match.start(_TABLE_GROUP)
+        elif match.group('set') or match.group('where') or match.group('tail') or match.group('terminator'):
+            if depth != 0:
+                continue
+            if target_start is not None and target_end is None:
+                target_end = match.start() # the alias, if any, runs up to the next clause.
+            if match.group('terminator'):
+                stmt_end = match.start()
+                break
+            if match.group('where') and where_start is None:
+                where_start = match.end()
+            elif match.group('tail') and tail_start is None:
+                tail_start = match.start()
+        else:
+            col_assignments.append(match.group('column'))
+            if match.group('null') and where_start is not None:
+                eq_null_found = True # 'column = NULL' never matches, 'IS NULL' is what was meant.
+    if table is None:
+        raise ValueError("Could not extract table name from query")
+    where_span = tail_span = None
+    if where_start is not None:
+        where_end = tail_start if tail_start is not None and tail_start > where_start else stmt_end
+        where_span = (where_start, where_end)
+    if tail_start is not None:
+        tail_span = (tail_start, stmt_end)
+    target_span = (target_start, stmt_end if target_end is None else target_end)
+    return ParsedQuery(query.lstrip()[:6].upper(), table, where_span, target_span, tail_span,
+                       tuple(col_assignments), eq_null_found)
+
+@dataclass(frozen=True)
+class UnsafeAnalysis:
+    """ Outcome of checking an UPDATE/DELETE query, handed from `analyze_unsafe` to `commit_unsafe`. """
+    query: str
+    table_name: str
+    select_query: str
+    affected_rows: int
+    warnings: Tuple[str, ...] = ()
+
+def _strip_terminator(query: str) -> str:
+    """ Query without its trailing `;`, so it can be used as a subquery. """
+    return query.rstrip().rstrip(';').rstrip()
+
+@functools.lru_cache(maxsize=512)
+def _compile(query: str) -> TextClause:
+    """ `text(query)`, built once per query string. TextClause is immutable, so sharing it is safe. """
+    return text(query)
+
+@functools.lru_cache(maxsize=8)
+def _get_engine(connection_string: str):
+    """ One pooled engine per connection string for the whole process, so connections stay warm between SafeSQL instances. """
+    return create_engine(connection_string, pool_pre_ping=True)
+
+def _json_safe_value(value):
+    """ A column value JSON can hold, in a form that can be turned back into the original given the column type. """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    if isinstance(value, (datetime.date, datetime.time)): # datetime is a date subclass.
+        return value.isoformat()
+    return str(value) # Decimal, UUID, ... all round-trip through their str().
+
+def _json_safe_row(row) -> Dict[str, Any]:
+    """ Row mapping as a JSON-serialisable dict, see `_json_safe_value`. """
+    return {key: _json_safe_value(value) for key, value in row.items()}
+
 class SafeSQL:
     """ Base class for Safe SQL"""
     def __init__(self, connection_string: str, mode: Mode = Mode.READ):
-        self.engine = create_engine(connection_string)
+        self.engine = _get_engine(connection_string)
         self.mode = mode
         self.logger = self._setup_logger()
-        self.inspector = inspect(self.engine)
+        self.inspector = inspect(self.engine) # per instance, so a new SafeSQL always reflects fresh.
+        self._columns_cache: Dict[str, frozenset] = {} # table name -> column names, dropped with the inspector's cache.
+        self._result_cache: "OrderedDict[str, bytes]" = OrderedDict() # query hash -> serialised result, least recently used first.
+        self._result_cache_lock = threading.Lock() # lookups reorder the dict, so even reads need it.
+        self._dispatch = {Mode.READ: self._dispatch_read, Mode.WRITE: self._dispatch_write, Mode.ADMIN: self._dispatch_admin}
 
     def _setup_logger(self):
-        """ Logging using the Logger module. """
+        """ Logging using the Logger module. Records are queued, and written to the file on a background thread. """
+        global _log_listener
         logger = logging.getLogger('SafeSQL')
         logger.setLevel(logging.INFO)
-        handler = logging.FileHandler('safe_sql.log')
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        if _log_listener is None:
+            log_queue = queue.Queue(-1)
+            handler = logging.FileHandler('safe_sql.log')
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            handler.setFormatter(formatter)
+            _log_listener = QueueListener(log_queue, handler)
+            _log_listener.start()
+            atexit.register(_log_listener.stop) # drains whatever is still queued.
+            logger.addHandler(QueueHandler(log_queue))
         return logger
 
     def execute_query(self, query: str, params: Optional[Dict[str, Any]] = None) -> Any:
         """ Based on the mode, we restrict the user to perform only certain queries on the DB."""
+        head = query.lstrip()[:16].upper() # only the leading keyword matters, no need to upper-case the whole query.
+        try:
+            return self._dispatch[self.mode](query, head, params)
+        except Exception as e:
+            self.logger.error("Query execution failed: %s", e)
+            raise
+
+    def _dispatch_read(self, query, head, params):
+        """ READ mode, SELECT only. """
+        if not head.startswith("SELECT"):
+            raise ValueError("Only SELECT queries are allowed in READ mode")
         with self.engine.begin() as connection:
-            try:
-                if self.mode == Mode.READ:
-                    if not query.strip().upper().startswith("SELECT"):
-                        raise ValueError("Only SELECT queries are allowed in READ mode")
-                    return self._execute_read_query(connection, query, params)
-                elif self.mode == Mode.WRITE:
-                    if query.strip().upper().startswith(("UPDATE", "DELETE")):
-                        return self._execute_unsafe_query(connection, query, params)
-                    return self._execute_write_query(connection, query, params)
-                elif self.mode == Mode.ADMIN:
-                    return self._execute_admin_query(connection, query, params)
-            except Exception as e:
-                self.logger.error(f"Query execution failed: {str(e)}")
-                raise
+            return self._execute_read_query(connection, query, params)
+
+    def _dispatch_write(self, query, head, params):
+        """ WRITE mode, UPDATE and DELETE go through the unsafe checks first. """
+        if head.startswith(("UPDATE", "DELETE")):
+            # Checks and the write run in separate transactions, so nothing is held open while the user decides.
+            analysis = self.analyze_unsafe(query)
+            self._report_unsafe_analysis(analysis)
+            self._confirm_unsafe_query()
+            return self.commit_unsafe(analysis, params)
+        with self.engine.begin() as connection:
+            return self._execute_write_query(connection, query, params)
+
+    def _dispatch_admin(self, query, head, params):
+        """ ADMIN mode, anything goes. """
+        with self.engine.begin() as connection:
+            return self._execute_admin_query(connection, query, params)
+
+    def analyze_unsafe(self, query: str) -> UnsafeAnalysis:
+        """ Run the UPDATE/DELETE sanity checks in a short transaction of their own. """
+        with self.engine.begin() as connection:
+            return self._check_unsafe_query(query, connection)
+
+    def commit_unsafe(self, analysis: UnsafeAnalysis, params: Optional[Dict[str, Any]] = None) -> Any:
+        """ Back up the affected rows and execute an analysed query, in a fresh transaction. """
+        if self.mode == Mode.READ:
+            raise ValueError("Only SELECT queries are allowed in READ mode")
+        with self.engine.begin() as connection:
+            return self._execute_unsafe_query(connection, analysis, params)
 
     def _execute_read_query(self, connection, query, params):
         """ Helper function to execute read query. """
-        self.logger.info(f"Executing READ query: {query}")
-        return connection.execute(text(query), params)
+        self.logger.info("Executing %s query: %s", "READ", query)
+        return connection.execute(_compile(query), params)
 
     def _execute_write_query(self, connection, query, params):
         """ Helper function to execute write query. """
-        self.logger.info(f"Executing WRITE query: {query}")
-        return connection.execute(text(query), params)
+        self.logger.info("Executing %s query: %s", "WRITE", query)
+        self._forget_schema() # WRITE accepts DDL too, e.g. ALTER TABLE.
+        return connection.execute(_compile(query), params)
 
     def _execute_admin_query(self, connection, query, params):
         """ Helper function to execute admin query. """
-        self.logger.warning(f"Executing ADMIN query: {query}")
-        return connection.execute(text(query), params)
+        self.logger.warning("Executing %s query: %s", "ADMIN", query)
+        self._forget_schema()
+        return connection.execute(_compile(query), params)
+
+    def _forget_schema(self):
+        """ DDL may change table definitions, so forget what we reflected so far, in both caches. """
+        self._columns_cache.clear()
+        self.inspector.clear_cache()
 
-    def _execute_unsafe_query(self, connection, query, params):
+    def _execute_unsafe_query(self, connection, analysis: UnsafeAnalysis, params):
         """ Even after being flagged as unsafe, we can execute, but give user the warnings and time to rethink. """
-        self._check_unsafe_query(query, connection)
-        self._create_backup(connection, query)
-        result = connection.execute(text(query), params)
-        self.logger.info(f"Executed unsafe query: {query}")
+        self._create_backup(connection, analysis.table_name, analysis.select_query)
+        result = connection.execute(_compile(analysis.query), params)
+        self.logger.info("Executed unsafe query: %s", analysis.query)
         return result
 
-    def _check_unsafe_query(self, query: str, connection):
+    def _check_unsafe_query(self, query: str, connection) -> UnsafeAnalysis:
         """ Check the unsafe query. Main function. """
-        table_name = self._extract_table_name(query)
+        parsed = _parse_query(query)
         
         # Get the SELECT equivalent
-        select_query = self._get_select_equivalent(query)
-        print(f"Equivalent SELECT query: {select_query}")
-        
-        # Execute the SELECT query to show affected rows
-        result = connection.execute(text(select_query))
-        affected_rows = result.rowcount
-        print(f"Number of rows that will be affected: {affected_rows}")
-        
-        # Check for common pitfalls
-        self._check_common_pitfalls(query, table_name, affected_rows)
+        select_query = self._get_select_equivalent(query, parsed)
         
-        # Validate schema
-        self._validate_schema(query, table_name)
+        # Count the affected rows on the server, rather than pulling them all back just for a rowcount
+        affected_rows = connection.execute(_compile(self._get_count_equivalent(select_query))).scalar()
         
-        # Ask for confirmation
+        # Check for common pitfalls, and validate schema
+        warnings = self._check_common_pitfalls(parsed.table, affected_rows, parsed.has_where, parsed.eq_null_found)
+        warnings += self._validate_schema(parsed.table, parsed.col_assignments)
+        for warning in warnings:
+            self.logger.warning("Unsafe query check: %s", warning)
+        return UnsafeAnalysis(query, parsed.table, select_query, affected_rows, tuple(warnings))
+
+    def _report_unsafe_analysis(self, analysis: UnsafeAnalysis):
+        """ Everything the user needs to decide goes out in one write. """
+        report = [f"Equivalent SELECT query: {analysis.select_query}",
+                  f"Number of rows that will be affected: {analysis.affected_rows}"]
+        report += [f"Warning: {warning}" for warning in analysis.warnings]
+        sys.stdout.write("\n".join(report) + "\n")
+
+    def _confirm_unsafe_query(self):
+        """ Ask for confirmation, called between `analyze_unsafe` and `commit_unsafe`. """
         confirmation = input("Do you want to proceed with this query? (y/n): ")
         if confirmation.lower() != 'y':
             raise ValueError("Query execution cancelled by user")
 
     def _extract_table_name(self, query: str) -> str:
         """ Extract table name from the query string, used by other function."""
-        match = re.search(r'\s+(?:FROM|UPDATE|DELETE\s+FROM)\s+(\w+)', query, re.IGNORECASE) # re to the rescue.
-        if match:
-            return match.group(1)
-        raise ValueError("Could not extract table name from query")
+        return _parse_query(query).table
 
-    def _get_select_equivalent(self, query: str) -> str:
+    def _get_select_equivalent(self, query: str, parsed: Optional[ParsedQuery] = None) -> str:
         """ Used when UPDATE and DELETE queries are used, just to have a sanity check."""
-        if query.strip().upper().startswith("UPDATE"):
-            table_name = self._extract_table_name(query)
-            where_clause = re.search(r'WHERE\s+(.+)(?:ORDER BY|LIMIT|$)', query, re.IGNORECASE | re.DOTALL)
-            where_clause = where_clause.group(1) if where_clause else ''
-            return f"SELECT * FROM {table_name} WHERE {where_clause}"
-        elif query.strip().upper().startswith("DELETE"):
-            return query.replace("DELETE", "SELECT *", 1)
-        else:
+        if parsed is None:
+            parsed = _parse_query(query)
+        if parsed.kind not in ("UPDATE", "DELETE"):
             raise ValueError("Unsupported query type for SELECT equivalent")
+        # Built from the parsed pieces for both, so no trailing ';' or the DELETE keyword itself ever survives,
+        # while the alias and ORDER BY / LIMIT are kept and the SELECT covers exactly the rows the query touches.
+        select_query = f"SELECT * FROM {query[slice(*parsed.target_span)].strip()}"
+        if parsed.has_where:
+            select_query += f" WHERE {query[slice(*parsed.where_span)].strip()}"
+        if parsed.tail_span is not None:
+            select_query += f" {query[slice(*parsed.tail_span)].strip()}"
+        return select_query
+
+    def _get_count_equivalent(self, select_query: str) -> str:
+        """ COUNT(*) over the SELECT equivalent, so the count and the backup always cover the same rows. """
+        # Newline before the closing paren, in case the query ends in a -- comment.
+        return f"SELECT COUNT(*) FROM ({_strip_terminator(select_query)}\n) x"
 
-    def _check_common_pitfalls(self, query: str, table_name: str, affected_rows: int):
+    def _check_common_pitfalls(self, table_name: str, affected_rows: int, has_where: bool, eq_null_found: bool) -> List[str]:
         """ NOTE: More will be added, till now common pitfalls are supported. PRs welcome. """
+        warnings = []
         if "company" in table_name.lower(): # assuming table has company in name.
-            print("Warning: You are modifying company data. Please double-check your query.")
-        if "WHERE" not in query.upper():
-            print("Warning: No WHERE clause found. This will affect all rows in the table.")
+            warnings.append("You are modifying company data. Please double-check your query.")
+        if not has_where:
+            warnings.append("No WHERE clause found. This will affect all rows in the table.")
         if affected_rows > 1000:
-            print(f"Warning: This query will affect {affected_rows} rows. Are you sure this is intended?")
-        if re.search(r'WHERE\s+\w+\s*=\s*NULL', query, re.IGNORECASE):
-            print("Warning: Using 'WHERE column = NULL' will not work as intended. Use 'WHERE column IS NULL' instead.")
+            warnings.append(f"This query will affect {affected_rows} rows. Are you sure this is intended?")
+        if eq_null_found:
+            warnings.append("Using 'WHERE column = NULL' will not work as intended. Use 'WHERE column IS NULL' instead.")
+        return warnings
 
-    def _validate_schema(self, query: str, table_name: str):
+    def _validate_schema(self, table_name: str, col_assignments: Tuple[str, ...]) -> List[str]:
         """ Sanity check to see whether the column name exist or not. """
-        columns = self.inspector.get_columns(table_name)
-        column_names = [col['name'] for col in columns]
+        column_names = self._columns_cache.get(table_name)
+        if column_names is None:
+            columns = self.inspector.get_columns(table_name)
+            column_names = self._columns_cache[table_name] = frozenset(col['name'].lower() for col in columns)
         
         # Check if all columns in the query exist in the table
-        for match in re.finditer(r'\b(\w+)\s*=', query):
-            col_name = match.group(1)
-            if col_name not in column_names:
-                print(f"Warning: Column '{col_name}' not found in table '{table_name}'")
+        return [f"Column '{col_name}' not found in table '{table_name}'" for col_name in col_assignments
+                if col_name.lower() not in column_names] # SQL identifiers are case-insensitive unless quoted.
 
-    def _create_backup(self, connection, query):
+    def _create_backup(self, connection, table_name: str, select_query: str):
         """ Utility function to cache the query results of the affected rows with timestamp. """
-        table_name = self._extract_table_name(query)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_table_name = f"{table_name}_backup_{timestamp}"
+        timestamp = time.strftime("%Y%m%d_%H%M%S") # local time, same as datetime.now().
+        backup_id = f"{timestamp}_{uuid.uuid4().hex[:8]}" # several backups can happen within the same second.
+        # Checked on every backup: with transactional DDL a rolled back query takes the CREATE TABLE with it.
+        _BACKUP_TABLE.create(connection, checkfirst=True)
         
-        # Create a backup of the affected rows
-        select_query = self._get_select_equivalent(query)
-        backup_query = f"CREATE TABLE {backup_table_name} AS {select_query}"
-        connection.execute(text(backup_query))
+        # Copy the affected rows into the backup table
+        params = {"backup_id": backup_id, "source_table": table_name}
+        if connection.dialect.name == 'postgresql':
+            # Postgres can build the JSON rows itself, so nothing leaves the server.
+            backup_query = ("INSERT INTO safe_sql_backups (backup_id, source_table, row) "
+                            f"SELECT :backup_id, :source_table, to_jsonb(x) FROM ({_strip_terminator(select_query)}\n) AS x") # newline, in case the query ends in a -- comment.
+            row_count = connection.execute(_compile(backup_query), params).rowcount
+        else:
+            row_count = 0
+            result = connection.execute(_compile(select_query)).mappings()
+            for batch in result.partitions(_BACKUP_BATCH_SIZE):
+                connection.execute(_BACKUP_TABLE.insert(), [dict(params, row=_json_safe_row(row)) for row in batch])
+                row_count += len(batch)
         
-        self.logger.info(f"Created backup table: {backup_table_name}")
-        print(f"Backup created: {backup_table_name}")
+        self.logger.info("Created backup %s of %d rows from table: %s", backup_id, row_count, table_name)
+        sys.stdout.write(f"Backup created: {backup_id}\n")
 
     def get_query_hash(self, query: str) -> str:
         """ Similar to version hash, to have a unique signature. """
-        return hashlib.md5(query.encode()).hexdigest()
+        query_hasher = _HASH_TEMPLATE.copy() # the template itself is never updated, so this is thread-safe.
+        query_hasher.update(query.encode('utf-8'))
+        return query_hasher.hexdigest() # 32 hex chars, same as md5.
+
+    def _cache_file(self, query_hash: str) -> str:
+        """ Files are sharded on the first two hex chars of the hash, so no single directory grows too large. """
+        return os.path.join(_RESULT_CACHE_DIR, query_hash[:2], f"{query_hash[2:]}.json")
+
+    def _remember_result(self, query_hash: str, data: bytes):
+        """ Put a serialised result in the in-memory LRU, evicting the oldest one when full. """
+        with self._result_cache_lock:
+            self._result_cache[query_hash] = data
+            self._result_cache.move_to_end(query_hash)
+            if len(self._result_cache) > _RESULT_CACHE_SIZE:
+                self._result_cache.popitem(last=False)
 
     def cache_query_result(self, query: str, result):
         """ Save the cached query results in a JSON file. """
         query_hash = self.get_query_hash(query) # the hash is based on the query itself, not the contents.
-        cache_file = f"query_cache/{query_hash}.json"
-        with open(cache_file, 'w') as f:
-            json.dump(result, f)
+        data = _dump_json(result) # before touching the disk, so a result that can't be serialised leaves nothing behind.
+        cache_file = self._cache_file(query_hash)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f"{cache_file}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, cache_file) # readers never see a half-written file.
+        self._remember_result(query_hash, data)
 
     def get_cached_result(self, query: str):
         """ Fetch the cached query results. """
         query_hash = self.get_query_hash(query)
-        cache_file = f"query_cache/{query_hash}.json"
-        try:
-            with open(cache_file, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return None
+        with self._result_cache_lock:
+            data = self._result_cache.get(query_hash)
+            if data is not None:
+                self._result_cache.move_to_end(query_hash)
+        if data is None:
+            try:
+                with open(self._cache_file(query_hash), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return None
+            self._remember_result(query_hash, data)
+        # Decoded on every hit, so memory and disk give the same value and callers can't mutate the cache.
+        return _load_json(data)
 
 """Command Line Interface, using Click for now, can work without it as well. """
 @click.group()
@@ -187,7 +449,12 @@ def cli():
 def execute(connection_string, mode, query):
     safe_sql = SafeSQL(connection_string, Mode(mode))
     result = safe_sql.execute_query(query)
-    click.echo(result.fetchall())
+    if not result.returns_rows:
+        if result.rowcount >= 0: # DDL and some drivers report -1, meaning not known.
+            click.echo(f"{result.rowcount} rows affected")
+        return
+    for row in result: # print rows as they come, rather than building the whole list first.
+        click.echo(row)
 
 if __name__ == '__main__':
     cli()
\ No newline at end of file
@@ -0,0 +1,242 @@
+import base64
+import datetime
+import json
+import logging
+import threading
+from logging.handlers import QueueHandler
+
+import pytest
+from click.testing import CliRunner
+from sqlalchemy import text
+
+import safe_sql.main
+from safe_sql.main import Mode, SafeSQL, _parse_query, cli
+
+
+def _where(query):
+    parsed = _parse_query(query)
+    return query[slice(*parsed.where_span)].strip() if parsed.has_where else None
+
+
+@pytest.mark.parametrize("query, kind, table", [
+    ("UPDATE users SET a = 1", "UPDATE", "users"),
+    ("  update users set a = 1", "UPDATE", "users"),
+    ("DELETE FROM users WHERE id = 1", "DELETE", "users"),
+    ("UPDATE t SET a = (SELECT b FROM u WHERE c = 1) WHERE id = 2", "UPDATE", "t"),
+])
+def test_kind_and_table(query, kind, table):
+    parsed = _parse_query(query)
+    assert (parsed.kind, parsed.table) == (kind, table)
+
+
+@pytest.mark.parametrize("query, where", [
+    ("DELETE FROM users", None),
+    ("UPDATE users SET a = 1 WHERE id = 3", "id = 3"),
+    ("UPDATE users SET a = 1 WHERE id = 3 ORDER BY id LIMIT 2;", "id = 3"),
+    ("DELETE FROM users WHERE id = 2;", "id = 2"),
+    ("DELETE FROM users WHERE(id=1)", "(id=1)"),
+    ("UPDATE users SET a = 1 where x = 1\n and y = 2;", "x = 1\n and y = 2"),
+    ("DELETE FROM users WHERE id IN (SELECT id FROM users ORDER BY id LIMIT 2)",
+     "id IN (SELECT id FROM users ORDER BY id LIMIT 2)"),
+    ("UPDATE t SET a = (SELECT b FROM u WHERE c = 1) WHERE id = 2", "id = 2"),
+    ("UPDATE t SET a = (SELECT b FROM u WHERE c = 1)", None),
+    ("UPDATE t SET note = 'x LIMIT 1; (' WHERE id = 2", "id = 2"),
+    ("UPDATE t SET a = 1 WHERE note = 'a) LIMIT 1' AND id = 2", "note = 'a) LIMIT 1' AND id = 2"),
+])
+def test_where_span(query, where):
+    assert _where(query) == where
+
+
+def test_column_assignments_skip_literals_and_comments():
+    parsed = _parse_query("UPDATE t SET a = 'b=c', d = 1 -- e = 2\nWHERE /* f = 3 */ id = 4")
+    assert parsed.col_assignments == ("a", "d", "id")
+
+
+@pytest.mark.parametrize("query, eq_null_found", [
+    ("DELETE FROM t WHERE a = NULL", True),
+    ("DELETE FROM t WHERE a = 1 AND b = null", True),
+    ("UPDATE t SET a = NULL WHERE id = 1", False),
+    ("DELETE FROM t WHERE a IS NULL", False),
+])
+def test_eq_null(query, eq_null_found):
+    assert _parse_query(query).eq_null_found is eq_null_found
+
+
+def test_missing_table():
+    with pytest.raises(ValueError):
+        _parse_query("UPDATE")
+
+
+@pytest.fixture
+def write_sql(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # safe_sql.log and query_cache/ land in the tmp dir.
+    connection_string = f"sqlite:///{tmp_path / 'test.db'}"
+    admin = SafeSQL(connection_string, Mode.ADMIN)
+    admin.execute_query("CREATE TABLE users (id INTEGER PRIMARY KEY, age INTEGER)")
+    admin.execute_query("INSERT INTO users VALUES (1, 10), (2, 20), (3, 30)")
+    return SafeSQL(connection_string, Mode.WRITE)
+
+
+@pytest.mark.parametrize("query, affected_rows", [
+    ("DELETE FROM users WHERE id = 2;", 1),
+    ("DELETE FROM users WHERE id IN (SELECT id FROM users ORDER BY id LIMIT 2)", 2),
+    ("UPDATE users SET age = 1 WHERE id IN (SELECT id FROM users ORDER BY id LIMIT 2)", 2),
+    ("UPDATE users SET age = (SELECT MAX(age) FROM users WHERE id < 3) WHERE id = 3", 1),
+    ("UPDATE users SET age = 1", 3),
+    ("DELETE FROM users WHERE id > 0 LIMIT 1", 1),
+    ("DELETE FROM users u WHERE u.id = 1", 1),
+])
+def test_analyze_unsafe_counts_affected_rows(write_sql, query, affected_rows):
+    assert write_sql.analyze_unsafe(query).affected_rows == affected_rows
+
+
+@pytest.mark.parametrize("query, select_query", [
+    ("DELETE FROM users WHERE id = 2;", "SELECT * FROM users WHERE id = 2"),
+    ("delete from users where id = 3", "SELECT * FROM users WHERE id = 3"),
+    ("DELETE FROM users", "SELECT * FROM users"),
+    ("UPDATE users SET age = 1 WHERE id = 1 LIMIT 1;", "SELECT * FROM users WHERE id = 1 LIMIT 1"),
+    ("DELETE FROM users WHERE id > 0 ORDER BY id LIMIT 1; -- done", "SELECT * FROM users WHERE id > 0 ORDER BY id LIMIT 1"),
+    ("DELETE FROM users u WHERE u.id = 1", "SELECT * FROM users u WHERE u.id = 1"),
+    ("UPDATE users AS u SET age = 1 WHERE u.id = 1", "SELECT * FROM users AS u WHERE u.id = 1"),
+    ("DELETE FROM users LIMIT 2", "SELECT * FROM users LIMIT 2"),
+])
+def test_select_equivalent(write_sql, query, select_query):
+    assert write_sql._get_select_equivalent(query) == select_query
+
+
+def test_commit_unsafe_backs_up_affected_rows(write_sql):
+    analysis = write_sql.analyze_unsafe("delete from users where id = 3;")
+    assert write_sql.commit_unsafe(analysis).rowcount == 1
+    with write_sql.engine.connect() as connection:
+        remaining = connection.execute(text("SELECT id FROM users ORDER BY id")).scalars().all()
+        backups = connection.execute(text("SELECT source_table, row FROM safe_sql_backups")).all()
+    assert remaining == [1, 2]
+    assert [(table, json.loads(row)) for table, row in backups] == [("users", {"id": 3, "age": 30})]
+
+
+def test_cached_result_is_the_serialised_value(write_sql):
+    write_sql.cache_query_result("SELECT 1", {1: (1, 2)})
+    from_memory = write_sql.get_cached_result("SELECT 1")
+    from_disk = SafeSQL(str(write_sql.engine.url)).get_cached_result("SELECT 1")
+    assert from_memory == from_disk == {"1": [1, 2]}
+    from_memory["1"].append(99)
+    assert write_sql.get_cached_result("SELECT 1") == {"1": [1, 2]}
+
+
+def test_unserialisable_result_leaves_no_files(write_sql, tmp_path):
+    with pytest.raises(TypeError):
+        write_sql.cache_query_result("SELECT 2", {"a": object()})
+    assert not (tmp_path / "query_cache").exists()
+    assert write_sql.get_cached_result("SELECT 2") is None
+
+
+def test_analyze_unsafe_where_without_space(write_sql):
+    analysis = write_sql.analyze_unsafe("DELETE FROM users WHERE(id=1)")
+    assert (analysis.select_query, analysis.affected_rows, analysis.warnings) == ("SELECT * FROM users WHERE (id=1)", 1, ())
+
+
+def test_new_instance_sees_columns_added_by_another(write_sql):
+    assert write_sql._validate_schema("users", ("name",)) == ["Column 'name' not found in table 'users'"]
+    write_sql.execute_query("ALTER TABLE users ADD COLUMN name TEXT")
+    assert SafeSQL(str(write_sql.engine.url), Mode.WRITE)._validate_schema("users", ("name",)) == []
+
+
+@pytest.mark.parametrize("mode", [Mode.WRITE, Mode.ADMIN])
+def test_columns_added_by_ddl_stop_warning(write_sql, mode):
+    write_sql.mode = mode
+    assert write_sql._validate_schema("users", ("name",)) == ["Column 'name' not found in table 'users'"]
+    write_sql.execute_query("ALTER TABLE users ADD COLUMN name TEXT")
+    assert write_sql._validate_schema("users", ("name",)) == []
+
+
+def test_backup_keeps_blob_and_date_values(write_sql):
+    admin = SafeSQL(str(write_sql.engine.url), Mode.ADMIN)
+    admin.execute_query("CREATE TABLE files (id INTEGER, data BLOB, added DATE)")
+    admin.execute_query("INSERT INTO files VALUES (1, :data, :added)",
+                        {"data": b"\x00\xffhi", "added": datetime.date(2024, 2, 29)})
+    write_sql.commit_unsafe(write_sql.analyze_unsafe("DELETE FROM files WHERE id = 1"))
+    with write_sql.engine.connect() as connection:
+        row = json.loads(connection.execute(text("SELECT row FROM safe_sql_backups")).scalar())
+    assert base64.b64decode(row["data"]) == b"\x00\xffhi"
+    assert row["added"] == "2024-02-29"
+
+
+def test_result_cache_is_thread_safe(write_sql, monkeypatch):
+    monkeypatch.setattr(safe_sql.main, "_RESULT_CACHE_SIZE", 4) # evict constantly.
+    errors = []
+
+    def hammer(n):
+        try:
+            for i in range(2000):
+                query = f"SELECT {(i + n) % 8}"
+                write_sql._remember_result(write_sql.get_query_hash(query), b"[1]")
+                write_sql.get_cached_result(query)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=hammer, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(write_sql._result_cache) <= 4
+
+
+def test_analyze_unsafe_prints_nothing(write_sql, capsys):
+    write_sql.analyze_unsafe("DELETE FROM users")
+    assert capsys.readouterr().out == ""
+
+
+def test_execute_query_reports_before_confirming(write_sql, capsys, monkeypatch):
+    def answer(prompt):
+        assert capsys.readouterr().out == (
+            "Equivalent SELECT query: SELECT * FROM users\n"
+            "Number of rows that will be affected: 3\n"
+            "Warning: No WHERE clause found. This will affect all rows in the table.\n"
+        )
+        return "n"
+
+    monkeypatch.setattr("builtins.input", answer)
+    with pytest.raises(ValueError, match="cancelled"):
+        write_sql.execute_query("DELETE FROM users")
+
+
+@pytest.mark.parametrize("mode, query, output", [
+    ("admin", "CREATE TABLE t (id INTEGER)", ""),
+    ("write", "INSERT INTO users VALUES (4, 40)", "1 rows affected\n"),
+    ("read", "SELECT id FROM users WHERE id < 3 ORDER BY id", "(1,)\n(2,)\n"),
+])
+def test_cli_execute(write_sql, mode, query, output):
+    result = CliRunner().invoke(cli, ["execute", "--connection-string", str(write_sql.engine.url),
+                                      "--mode", mode, "--query", query])
+    assert (result.exit_code, result.output) == (0, output)
+
+
+def test_no_connection_held_while_confirming(write_sql, monkeypatch):
+    checked_out = []
+
+    def answer(prompt):
+        checked_out.append(write_sql.engine.pool.checkedout())
+        return "y"
+
+    monkeypatch.setattr("builtins.input", answer)
+    assert write_sql.execute_query("DELETE FROM users WHERE id = 1").rowcount == 1
+    assert checked_out == [0]
+
+
+@pytest.mark.parametrize("column", ["age", "AGE", "Age"])
+def test_validate_schema_ignores_column_case(write_sql, column):
+    assert write_sql._validate_schema("users", (column, "ID")) == []
+
+
+def test_logger_handler_added_once(write_sql):
+    for _ in range(3):
+        SafeSQL(str(write_sql.engine.url))
+    handlers = logging.getLogger("SafeSQL").handlers
+    assert len([handler for handler in handlers if isinstance(handler, QueueHandler)]) == 1
+
+
+def test_identifiers_are_ascii_on_either_engine():
+    # \w is ASCII-only under RE2, and the stdlib fallback is compiled with re.ASCII to match it.
+    assert _parse_query("UPDATE t SET é = 1, a = 2 WHERE id = 3").col_assignments == ("a", "id")